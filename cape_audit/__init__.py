@@ -1,8 +1,10 @@
 from .cape_audit import CapeDynamicTestBase, CapeTestObjective, OSTarget, ObjectiveResult
+from .report import ReportView
 
 __all__ = [
     "CapeDynamicTestBase",
     "CapeTestObjective",
     "OSTarget",
     "ObjectiveResult",
+    "ReportView",
 ]
@@ -2,10 +2,32 @@
 from __future__ import annotations
 from typing import List, Union, Dict, Any
 import json
+import functools
 import logging
 import os
+from concurrent.futures import ThreadPoolExecutor
 from enum import Enum
 from .verifiers import MissingResultVerifier
+from .scanning import ReportTextScanner, can_scan
+from .report import ReportView, IndexedReport, ijson, report_cache_path, read_cached_report, write_cached_report
+
+try:
+    # orjson is an optional, much faster drop-in for parsing large reports
+    import orjson as _json
+except ImportError:
+    _json = json
+
+def _loads_report(data: bytes) -> Any:
+    try:
+        return _json.loads(data)
+    except ValueError:
+        if _json is json:
+            raise
+        # orjson rejects NaN, Infinity and out of range numbers (eg: 1e400), which json accepts
+        return json.loads(data)
+
+'''Upper limit on threads used to verify top-level objectives concurrently'''
+MAX_VERIFICATION_THREADS = 8
 
 class OSTarget(str, Enum):
     WINDOWS = "windows"
@@ -38,11 +60,74 @@ class ObjectiveResult(str, Enum):
     def __str__(self):
         return self.value
 
+# Objective states are stored as plain strings. They compare equal to the ObjectiveResult
+# members but skip the Enum machinery when the objective tree is evaluated.
+_UNTESTED = ObjectiveResult.UNTESTED.value
+_SUCCESS = ObjectiveResult.SUCCESS.value
+_FAILURE = ObjectiveResult.FAILURE.value
+_ERROR = ObjectiveResult.ERROR.value
+_INFO = ObjectiveResult.INFO.value
+_SKIPPED = ObjectiveResult.SKIPPED.value
+'''States in which child objectives are evaluated'''
+_CONTINUE_STATES = frozenset({_SUCCESS, _INFO})
+
+_JSON_SCALARS = (str, int, float, bool, type(None))
+
+'''Marks objective test data that is taken from the parent objective'''
+_INHERITED = object()
+
+def _check_json_serializable(value: Any) -> None:
+    '''
+    Raises TypeError if json.dumps would reject value, without serialising it.
+    Circular references raise ValueError, as they do in json.dumps.
+    '''
+    # containers currently being walked, to tell circular references from shared ones
+    active = set()
+    stack = [(False, value)]
+    while stack:
+        leaving, item = stack.pop()
+        if leaving:
+            active.discard(id(item))
+            continue
+        if isinstance(item, _JSON_SCALARS):
+            continue
+        if isinstance(item, dict):
+            for key in item:
+                if not isinstance(key, _JSON_SCALARS):
+                    raise TypeError(f"keys must be str, int, float, bool or None, not {type(key).__name__}")
+            children = item.values()
+        elif isinstance(item, (list, tuple)):
+            children = item
+        else:
+            raise TypeError(f"Object of type {type(item).__name__} is not JSON serializable")
+        if id(item) in active:
+            raise ValueError("Circular reference detected")
+        active.add(id(item))
+        stack.append((True, item))
+        stack.extend((False, child) for child in children)
+
+def _uses_report_string(verifier) -> bool:
+    '''
+    Verifiers can set needs_report_string = False to declare their evaluate() ignores
+    report_string, otherwise it is assumed they use it. The flag only counts if it is
+    set on the class that defines evaluate (or below it), so a subclass of a built-in
+    verifier which overrides evaluate doesn't inherit it.
+    '''
+    if 'needs_report_string' in getattr(verifier, '__dict__', {}):
+        return bool(verifier.needs_report_string)
+    for cls in type(verifier).__mro__:
+        if 'needs_report_string' in cls.__dict__:
+            return bool(cls.__dict__['needs_report_string'])
+        if 'evaluate' in cls.__dict__:
+            return True
+    return True
+
 class CapeTestObjective:
     def __init__(self, objective_name :str, requirement :str, test, is_informational=False):
         self.name = objective_name
         self.children = []
-        self.state = ObjectiveResult.UNTESTED
+        self._children_by_name = {}
+        self.state = _UNTESTED
         self.state_reason = "Objective has not been tested yet"
         self.test = test
         self.result_verifier = MissingResultVerifier()
@@ -50,9 +135,12 @@ class CapeTestObjective:
         self.requirement = requirement
         self._success_msg = "set_success_msg() was not called when creating the objective"
         self._failure_msg = "set_failure_msg() was not called when creating the objective"
-        self.report = {'error':'report not initialised'}
-        self.report_string = "error: report string not initialised"
-        self.storage_path = "error: storage path not initialised"
+        # test data is inherited from the parent objective unless it is set on this one
+        self._report = _INHERITED
+        self._report_string = _INHERITED
+        self._storage_path = _INHERITED
+        self._parent = None
+        self._results_cache = None
 
     def get_requirement(self): 
         return self.requirement
@@ -70,9 +158,44 @@ class CapeTestObjective:
         self._failure_msg = msg
 
     def set_test_data(self, report: dict, report_string: str, storage_path: str):
-        self.report = report
-        self.report_string = report_string
-        self.storage_path = storage_path
+        ''' Set the data this objective and its descendants are verified against.
+        Child objectives use their nearest ancestor's data unless they have their own. '''
+        self._report = report
+        self._report_string = report_string
+        self._storage_path = storage_path
+
+    def _inherited(self, attr: str, default: Any) -> Any:
+        objective = self
+        while objective is not None:
+            value = getattr(objective, attr)
+            if value is not _INHERITED:
+                return value
+            objective = objective._parent
+        return default
+
+    @property
+    def report(self) -> dict:
+        return self._inherited('_report', {'error':'report not initialised'})
+
+    @report.setter
+    def report(self, value: dict) -> None:
+        self._report = value
+
+    @property
+    def report_string(self) -> str:
+        return self._inherited('_report_string', "error: report string not initialised")
+
+    @report_string.setter
+    def report_string(self, value: str) -> None:
+        self._report_string = value
+
+    @property
+    def storage_path(self) -> str:
+        return self._inherited('_storage_path', "error: storage path not initialised")
+
+    @storage_path.setter
+    def storage_path(self, value: str) -> None:
+        self._storage_path = value
 
     def set_result_verifier(self, evaluator_object):
         if not hasattr(evaluator_object, "evaluate"):
@@ -80,56 +203,95 @@ class CapeTestObjective:
         self.result_verifier = evaluator_object
 
     def run_objective_verification(self):
+        '''
+        Verify this objective, then its descendants in depth-first order. The tree
+        is walked with an explicit stack rather than recursion. Children of objectives
+        that were not met are skipped.
+        '''
+        stack = [self]
+        while stack:
+            objective = stack.pop()
+            objective._verify()
+            if objective.state in _CONTINUE_STATES:
+                stack.extend(reversed(objective.children))
+            else:
+                for child in objective.children:
+                    child.set_skipped("The parent objective was not met")
+
+    def _verify(self):
+        '''
+        Run this objective's verifier and set its state, without touching its children
+        '''
         try:
             result = self.result_verifier.evaluate(self.report, self.report_string, self.storage_path)
             self.state_reason = self._success_msg if result else self._failure_msg
             if self._is_informational:
-                self.state = ObjectiveResult.INFO
+                self.state = _INFO
             else:
-                self.state = ObjectiveResult.SUCCESS if result else ObjectiveResult.FAILURE
+                self.state = _SUCCESS if result else _FAILURE
         except Exception as e:
-            self.state = ObjectiveResult.ERROR
+            self.state = _ERROR
             self.state_reason = f"An exception was thrown during verification: {str(e)}"
             log = logging.getLogger(__name__)
             log.exception("An exception was thrown during verification of test %s:%s",self.test.name, self.name)
-            
-        if self.state in [ObjectiveResult.SUCCESS, ObjectiveResult.INFO]:
-            for child in self.children:
-                child.set_test_data(self.report, self.report_string, self.storage_path)
-                child.run_objective_verification()
-        else:
-            for child in self.children:
-                child.set_skipped("The parent objective was not met")
+        self._invalidate_results()
 
     def set_skipped(self, reason):
-        self.state = ObjectiveResult.SKIPPED
-        self.state_reason = reason
-        for child in self.children:
-            child.set_skipped(reason)
+        stack = [self]
+        while stack:
+            objective = stack.pop()
+            objective.state = _SKIPPED
+            objective.state_reason = reason
+            objective._invalidate_results()
+            stack.extend(objective.children)
 
     def add_child_objective(self, objective: CapeTestObjective):
         ''' Add another objective which is evaluated if
         this objective is evaluated and does not fail '''
-        if objective.name in {d.name for d in self.children}:
+        if objective.name in self._children_by_name:
             raise ValueError(f"Objective {self.name} already has a child objective called {objective.name}")
-        objective.set_test_data(self.report, self.report_string, self.storage_path)
+        objective._parent = self
+        self._children_by_name[objective.name] = objective
         self.children.append(objective)
+        self._invalidate_results()
 
     def get_results(self):
-        result = {
-            'state':self.state, 
-            'state_reason': self.state_reason,
-            'children': {}
-            }      
-        for child in self.children:
-            result['children'][child.name] = child.get_results()
-        return result
+        '''
+        Get a nested dictionary of this objective's results. The dictionary is
+        reused until the objective or one of its descendants changes state.
+        '''
+        if self._results_cache is None:
+            result = {
+                'state':self.state, 
+                'state_reason': self.state_reason,
+                'children': {}
+                }      
+            for child in self.children:
+                result['children'][child.name] = child.get_results()
+            self._results_cache = result
+        return self._results_cache
+
+    def _invalidate_results(self):
+        '''
+        Discard the cached results of this objective, its ancestors and the test.
+        A cached parent always has cached children, so this stops at the first
+        objective which has nothing cached.
+        '''
+        objective = self
+        while objective is not None:
+            if objective._results_cache is None:
+                return
+            objective._results_cache = None
+            objective = objective._parent
+        if isinstance(self.test, CapeDynamicTestBase):
+            self.test._results_cache = None
         
 
 class CapeDynamicTestBase:
     def __init__(self, test_name, analysis_package):
         self._metadata = {"Name": test_name, "Package":analysis_package}
         self._objectives = []
+        self._objectives_by_name = {}
         self.name = test_name
         self.package = analysis_package
         self.set_task_timeout_seconds(120)
@@ -140,6 +302,13 @@ class CapeDynamicTestBase:
         self.set_enforce_timeout(False)
         self.set_os_targets([])
         self.set_task_config({})
+        self.set_lazy_report_parsing(False)
+        self._text_scanner = None
+        self._results_cache = None
+        self._real_storage_directory = None
+        self._report_path = None
+        self.report_bytes = None
+        self._report_string = None
     
     def init_metadata(self, metadata: dict):
         ''' Set metadata from a dict (eg: matching the format from get_metadata()) 
@@ -165,31 +334,133 @@ class CapeDynamicTestBase:
             raise FileNotFoundError(f"Test storage dir {test_storage_directory} not found ")
         if not os.path.isdir(test_storage_directory):
             raise IsADirectoryError(f"Test storage dir {test_storage_directory} not a directory")
-        reportpath = os.path.join(test_storage_directory, "reports", "report.json")
+        # Resolved once so every verifier sees the same task, even if the path is a
+        # symlink (eg: storage/analyses/latest) that is retargeted during evaluation
+        self._real_storage_directory = os.path.realpath(test_storage_directory)
+        reportpath = os.path.join(self._real_storage_directory, "reports", "report.json")
         
         if not os.path.exists(reportpath):
             raise FileNotFoundError(f"Test evaluation requires a report at {reportpath}")
 
-        with open(reportpath) as f:
-            self.report_string = f.read()
-        self.report = json.loads(self.report_string)
+        # the raw report is only read and decoded if something needs it
+        self._report_path = reportpath
+        self.report_bytes = None
+        self._report_string = None
+        self.report = self._parse_report(reportpath)
         self.test_storage_directory= test_storage_directory
+        self._results_cache = None
         self._run_objective_verification()
         return self.get_results()
 
+    @property
+    def report_string(self) -> str:
+        '''
+        The text of report.json, read and decoded the first time it is used
+        '''
+        if self._report_string is None:
+            if self._report_path is None:
+                return ""
+            self._report_string = self._read_report_bytes().decode('utf-8')
+        return self._report_string
+
+    @report_string.setter
+    def report_string(self, value: str) -> None:
+        self._report_string = value
+
+    def _read_report_bytes(self) -> bytes:
+        if self.report_bytes is None:
+            with open(self._report_path, 'rb') as f:
+                self.report_bytes = f.read()
+        return self.report_bytes
+
+    def _needs_report_string(self) -> bool:
+        '''
+        Whether any verifier besides the scanned text verifiers (which search the raw bytes)
+        will search the decoded report text
+        '''
+        for objective in self._iter_objectives():
+            verifier = objective.result_verifier
+            if not can_scan(verifier) and _uses_report_string(verifier):
+                return True
+        return False
+
+    def _parse_report(self, reportpath: str):
+        if self._lazy_report:
+            return ReportView(reportpath)
+
+        cache_path = report_cache_path(reportpath)
+        report = read_cached_report(cache_path) if cache_path is not None else None
+        if report is None:
+            report = _loads_report(self._read_report_bytes())
+            if cache_path is not None:
+                write_cached_report(cache_path, report)
+
+        if isinstance(report, dict):
+            report = IndexedReport(report)
+        return report
+
     def _run_objective_verification(self):
-        for objective in self._objectives:
-            objective.set_test_data(self.report, self.report_string, self.test_storage_directory)
-            objective.run_objective_verification()
+        scanner = self._get_text_scanner()
+        if scanner.verifiers:
+            scanner.scan(self._read_report_bytes(), lambda: self.report_string)
+        report_string = self.report_string if self._needs_report_string() else ""
+        verify = functools.partial(self._verify_objective, report_string=report_string)
+        try:
+            if len(self._objectives) > 1:
+                # Each top-level objective owns its subtree, so they can be verified concurrently.
+                # This mostly helps objectives waiting on file I/O, eg: VerifyFileContainsPattern.
+                workers = min(MAX_VERIFICATION_THREADS, len(self._objectives))
+                with ThreadPoolExecutor(max_workers=workers) as executor:
+                    list(executor.map(verify, self._objectives))
+            else:
+                for objective in self._objectives:
+                    verify(objective)
+        finally:
+            scanner.clear()
+
+    def _verify_objective(self, objective: CapeTestObjective, report_string: str):
+        objective.set_test_data(self.report, report_string, self._real_storage_directory)
+        objective.run_objective_verification()
+
+    def _iter_objectives(self):
+        '''
+        Every objective in the test, parents before their children
+        '''
+        stack = list(reversed(self._objectives))
+        while stack:
+            objective = stack.pop()
+            yield objective
+            stack.extend(reversed(objective.children))
+
+    def _get_text_scanner(self) -> ReportTextScanner:
+        '''
+        A scanner for all the raw-text verifiers in the objective tree. Building one can
+        involve compiling a pattern database, so it is reused until the verifiers change.
+        '''
+        unique = {}
+        for objective in self._iter_objectives():
+            verifier = objective.result_verifier
+            if can_scan(verifier):
+                unique.setdefault(id(verifier), verifier)
+        verifiers = list(unique.values())
+
+        scanner = self._text_scanner
+        if scanner is None or len(scanner.verifiers) != len(verifiers) or \
+                any(a is not b for a, b in zip(scanner.verifiers, verifiers)):
+            scanner = self._text_scanner = ReportTextScanner(verifiers)
+        return scanner
        
     def get_results(self) -> Dict:
         '''
-        Get a nested dictionary of evaluated objective results
+        Get a nested dictionary of evaluated objective results. The dictionary is
+        reused until an objective changes state, so callers should not modify it.
         '''
-        results = {}
-        for objective in self._objectives:
-            results[objective.name] = objective.get_results()
-        return results
+        if self._results_cache is None:
+            results = {}
+            for objective in self._objectives:
+                results[objective.name] = objective.get_results()
+            self._results_cache = results
+        return self._results_cache
        
     def set_description(self, test_description: str) -> None:
         self._metadata["Description"] = test_description
@@ -215,14 +486,25 @@ class CapeDynamicTestBase:
         self._metadata["Enforce Timeout"] = val
 
     def set_os_targets(self, targets: Union[OSTarget, List[OSTarget]]) -> None:
-        if isinstance(targets, OSTarget):
-            self._metadata["Targets"] = [str(targets)]
-        else:
-            self._metadata["Targets"] = [str(t) for t in targets]
+        if isinstance(targets, str):
+            # a single target, either an OSTarget or its string value
+            targets = [targets]
+        self._metadata["Targets"] = [t.value if isinstance(t, OSTarget) else str(t) for t in targets]
         
+    def set_lazy_report_parsing(self, enabled: bool) -> None:
+        '''
+        If enabled, verifiers receive a read-only ReportView instead of a dict and
+        only the top-level report sections they access are parsed. Requires ijson,
+        falls back to parsing the whole report if it is not installed.
+        '''
+        if enabled and ijson is None:
+            logging.getLogger(__name__).warning("ijson is not installed, lazy report parsing is disabled")
+            enabled = False
+        self._lazy_report = enabled
+
     def set_task_config(self, task_config: Dict[str, Any]) -> None:
         try:
-            json.dumps(task_config)
+            _check_json_serializable(task_config)
             if task_config.get("Request Options",None) is None:
                 task_config = ""
             self._metadata["Task Config"] = task_config
@@ -235,9 +517,11 @@ class CapeDynamicTestBase:
         '''
         # This permits duplicate objective names within different levels of the tree
         # Internally we will concat the names so they are still unique
-        if objective.name in {d.name for d in self._objectives}:
+        if objective.name in self._objectives_by_name:
             raise ValueError(f"Test already has an Objective called {objective.name}")
+        self._objectives_by_name[objective.name] = objective
         self._objectives.append(objective)
+        self._results_cache = None
 
     def _print_objective_results(self, name, objinfo, indent = 0):
         print(f"{indent*' '}{name}: {objinfo['state']} ({objinfo['state_reason']})")
@@ -0,0 +1,192 @@
+from typing import Any, Dict, Iterator, List
+from collections.abc import Mapping
+import hashlib
+import logging
+import os
+import pickle
+import stat
+import tempfile
+import threading
+import time
+
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+_MISSING = object()
+
+'''Set to a directory to cache parsed reports between evaluations'''
+CACHE_DIR_ENV = "CAPE_AUDIT_CACHE_DIR"
+'''Cached reports not used for this long are deleted'''
+CACHE_MAX_AGE_SECONDS = 7 * 24 * 60 * 60
+'''Only this many of the most recently used cached reports are kept'''
+CACHE_MAX_ENTRIES = 32
+
+
+class IndexedReport(dict):
+    """
+    A parsed report.json, plus an index of the paths verifiers have resolved in it.
+
+    Objectives in a test often share paths like 'behavior/processes/calls', so
+    VerifyReportSectionHasMatching stores each path it resolves from the root of
+    the report in path_index (keyed by the tuple of path keys) and later verifiers
+    reuse it instead of walking the report again. Exact-match value indexes over
+    those paths are stored there too, keyed by (path keys, field keys). Indexed
+    values are shared, so they must not be modified.
+    """
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.path_index: Dict[tuple, Any] = {}
+
+
+class ReportView(Mapping):
+    """
+    Read-only, lazily parsed view of a report.json file
+
+    Top-level sections are only parsed (with ijson) the first time they are
+    accessed and are then cached, so a test whose verifiers only look at
+    eg: 'behavior' never materialises the rest of the report.
+    Resolved paths are indexed in path_index as with IndexedReport.
+
+    Keyword arguments
+    report_path -- path to the report.json file
+    """
+    def __init__(self, report_path: str):
+        if ijson is None:
+            raise ImportError("ReportView requires the ijson module")
+        self.report_path = report_path
+        self._sections: Dict[str, Any] = {}
+        self._keys: List[str] | None = None
+        self.path_index: Dict[tuple, Any] = {}
+        # objectives are verified concurrently, so each section has a lock to make sure it is only parsed once
+        self._lock = threading.Lock()
+        self._section_locks: Dict[str, threading.Lock] = {}
+        self._keys_lock = threading.Lock()
+
+    def __getitem__(self, key: str) -> Any:
+        if key not in self._sections:
+            with self._lock:
+                section_lock = self._section_locks.setdefault(key, threading.Lock())
+            with section_lock:
+                if key not in self._sections:
+                    self._sections[key] = self._parse_section(key)
+        value = self._sections[key]
+        if value is _MISSING:
+            raise KeyError(key)
+        return value
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._section_keys())
+
+    def __len__(self) -> int:
+        return len(self._section_keys())
+
+    def _parse_section(self, key: str) -> Any:
+        with open(self.report_path, 'rb') as f:
+            if '.' in key or not key:
+                # ijson uses '.' as its prefix separator and '' for the whole document,
+                # so these keys can't be addressed directly
+                for k, v in ijson.kvitems(f, '', use_float=True):
+                    if k == key:
+                        return v
+                return _MISSING
+            return next(ijson.items(f, key, use_float=True), _MISSING)
+
+    def _section_keys(self) -> List[str]:
+        with self._keys_lock:
+            if self._keys is None:
+                with open(self.report_path, 'rb') as f:
+                    self._keys = [value for prefix, event, value in ijson.parse(f)
+                                  if prefix == '' and event == 'map_key']
+        return self._keys
+
+
+def report_cache_path(report_path: str) -> str | None:
+    """
+    Get the file a parsed copy of report_path is cached in, or None if caching is disabled.
+    The key changes whenever the report is rewritten, so stale entries are never used.
+    """
+    cache_dir = os.environ.get(CACHE_DIR_ENV)
+    if not cache_dir:
+        return None
+    if not hasattr(os, 'getuid'):
+        # without file ownership the cache directory can't be checked, see _is_private
+        logging.getLogger(__name__).warning("%s is only supported on POSIX systems", CACHE_DIR_ENV)
+        return None
+    st = os.stat(report_path)
+    key = f"{os.path.abspath(report_path)}|{st.st_mtime_ns}|{st.st_size}"
+    return os.path.join(cache_dir, hashlib.sha1(key.encode('utf-8')).hexdigest() + ".pkl")
+
+
+def _is_private(path: str, is_dir: bool) -> bool:
+    """
+    Cache entries are unpickled, which can run arbitrary code, so they are only trusted if
+    the entry and its directory belong to the current user and nobody else can write to them
+    """
+    try:
+        st = os.lstat(path)
+    except FileNotFoundError:
+        return False
+    file_type = stat.S_ISDIR if is_dir else stat.S_ISREG
+    return file_type(st.st_mode) and st.st_uid == os.getuid() and not st.st_mode & 0o022
+
+
+def read_cached_report(cache_path: str) -> Dict[str, Any] | None:
+    """Returns the cached report, or None on a cache miss"""
+    cache_dir = os.path.dirname(cache_path)
+    if not os.path.exists(cache_path):
+        return None
+    if not _is_private(cache_dir, is_dir=True) or not _is_private(cache_path, is_dir=False):
+        logging.getLogger(__name__).warning("Ignoring report cache %s, it is not private to this user", cache_path)
+        return None
+    try:
+        with open(cache_path, 'rb') as f:
+            report = pickle.load(f)
+        # mark the entry as recently used so it is pruned last
+        os.utime(cache_path)
+        return report
+    except FileNotFoundError:
+        return None
+    except Exception:
+        logging.getLogger(__name__).warning("Ignoring unreadable report cache %s", cache_path, exc_info=True)
+        return None
+
+
+def write_cached_report(cache_path: str, report: Dict[str, Any]) -> None:
+    """Cache a parsed report. Failures are logged and otherwise ignored."""
+    cache_dir = os.path.dirname(cache_path)
+    try:
+        os.makedirs(cache_dir, mode=0o700, exist_ok=True)
+        if not _is_private(cache_dir, is_dir=True):
+            logging.getLogger(__name__).warning("Not caching reports in %s, it is not private to this user", cache_dir)
+            return
+        # write to a temporary file first so other readers never see a partial cache entry
+        fd, tmp_path = tempfile.mkstemp(dir=cache_dir, suffix=".tmp")
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump(report, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, cache_path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+        _prune_cache(cache_dir)
+    except Exception:
+        logging.getLogger(__name__).warning("Failed to write report cache %s", cache_path, exc_info=True)
+
+
+def _prune_cache(cache_dir: str) -> None:
+    """Delete entries older than CACHE_MAX_AGE_SECONDS, then all but the CACHE_MAX_ENTRIES most recently used"""
+    entries = []
+    with os.scandir(cache_dir) as it:
+        for entry in it:
+            if entry.name.endswith(".pkl") and entry.is_file(follow_symlinks=False):
+                entries.append((entry.stat(follow_symlinks=False).st_mtime, entry.path))
+    entries.sort(reverse=True)
+    oldest_allowed = time.time() - CACHE_MAX_AGE_SECONDS
+    for i, (mtime, path) in enumerate(entries):
+        if i >= CACHE_MAX_ENTRIES or mtime < oldest_allowed:
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
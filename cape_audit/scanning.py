@@ -0,0 +1,299 @@
+from typing import Callable, Dict, List
+import logging
+import re
+
+from .verifiers import VerifyReportHasExactString, VerifyReportHasPattern
+
+try:
+    import hyperscan
+except ImportError:
+    hyperscan = None
+
+try:
+    import ahocorasick
+except ImportError:
+    ahocorasick = None
+
+_SCANNED_EVALUATES = (VerifyReportHasExactString.evaluate, VerifyReportHasPattern.evaluate)
+
+
+def can_scan(verifier) -> bool:
+    '''
+    Whether ReportTextScanner can compute a verifier's result. Subclasses of the text
+    verifiers which override evaluate might check more than the pattern, so they are excluded.
+    '''
+    return type(verifier).evaluate in _SCANNED_EVALUATES
+
+
+class ReportTextScanner:
+    """
+    Evaluates all of a test's raw-text verifiers (VerifyReportHasExactString and
+    VerifyReportHasPattern) together with a single pass over the report, instead of
+    each verifier searching the whole report separately.
+
+    Hyperscan is used if it is installed. Regexes it can't handle are combined into
+    alternations (one per set of flags) and searched with Python's re instead, and
+    exact strings are matched with a single Aho-Corasick automaton (pyahocorasick).
+
+    Searching is done on the raw report bytes wherever that gives the same result as
+    searching the text, so the report usually never has to be decoded:
+    * exact strings are always searched as UTF-8 bytes
+    * bytes patterns are searched as they are
+    * text patterns are searched as bytes if both the pattern and the report are ASCII
+
+    Results are stored on the verifiers by scan() and returned by their evaluate()
+    until clear() is called.
+
+    Keyword arguments
+    verifiers -- the text verifiers to evaluate
+    """
+    def __init__(self, verifiers: List):
+        self.verifiers = verifiers
+        self._hs_db = None
+        self._hs_indexes = set()
+        self._hs_needs_utf8 = False
+        if hyperscan is not None:
+            self._compile_hyperscan()
+
+        self._literals: Dict[bytes, List[int]] = {}
+        self._patterns: Dict[int, re.Pattern] = {}
+        for index, verifier in enumerate(verifiers):
+            if index in self._hs_indexes:
+                continue
+            if isinstance(verifier, VerifyReportHasExactString):
+                self._literals.setdefault(verifier.pattern_bytes, []).append(index)
+            else:
+                self._patterns[index] = verifier.pattern
+
+        self._automaton = None
+        if ahocorasick is not None and len(self._literals) > 1:
+            self._build_automaton()
+
+        self._bytes_patterns: Dict[int, re.Pattern | None] = {}
+        self._alternations = {}
+        # how the patterns are grouped depends on whether the report is ASCII, so a plan is kept for each
+        self._pattern_plans = {}
+
+    def scan(self, report_bytes: bytes, get_report_string: Callable[[], str]) -> None:
+        '''
+        Search the report for every verifier
+
+        Keyword arguments
+        report_bytes -- the raw report.json
+        get_report_string -- returns the decoded report, only called if a pattern needs it
+        '''
+        matched = set()
+        if self._hs_db is not None:
+            if self._hs_needs_utf8 and not report_bytes.isascii():
+                # hyperscan's UTF-8 mode requires valid UTF-8, which decoding verifies
+                get_report_string()
+            def on_match(index, start, end, flags, context):
+                matched.add(index)
+            self._hs_db.scan(report_bytes, match_event_handler=on_match)
+
+        matched.update(self._scan_literals(report_bytes))
+        matched.update(self._scan_patterns(report_bytes, get_report_string))
+
+        for index, verifier in enumerate(self.verifiers):
+            verifier._prescan_result = index in matched
+
+    def clear(self) -> None:
+        '''Make the verifiers search the report_string they are given again'''
+        for verifier in self.verifiers:
+            verifier._prescan_result = None
+
+    def _compile_hyperscan(self) -> None:
+        expressions = {}
+        for index, verifier in enumerate(self.verifiers):
+            expression = _hyperscan_expression(verifier)
+            if expression is not None:
+                expressions[index] = expression
+
+        # Hyperscan rejects the whole database if one pattern is unsupported (eg: backreferences),
+        # so find those and leave them to Python's re
+        for index, (expression, flags) in list(expressions.items()):
+            try:
+                hyperscan.Database().compile(expressions=[expression], ids=[index], elements=1, flags=[flags])
+            except hyperscan.error as e:
+                logging.getLogger(__name__).debug("Pattern %r not supported by hyperscan: %s", expression, e)
+                del expressions[index]
+
+        if not expressions:
+            return
+        self._hs_db = hyperscan.Database()
+        self._hs_db.compile(expressions=[e for e, _ in expressions.values()],
+                            ids=list(expressions.keys()),
+                            elements=len(expressions),
+                            flags=[f for _, f in expressions.values()])
+        self._hs_indexes = set(expressions.keys())
+        self._hs_needs_utf8 = any(f & hyperscan.HS_FLAG_UTF8 for _, f in expressions.values())
+
+    def _build_automaton(self) -> None:
+        # pyahocorasick matches str, so bytes are mapped 1:1 onto characters with latin-1
+        automaton = ahocorasick.Automaton()
+        for literal, indexes in self._literals.items():
+            if literal:
+                automaton.add_word(literal.decode('latin-1'), indexes)
+        automaton.make_automaton()
+        self._automaton = automaton
+
+    def _scan_literals(self, report_bytes: bytes) -> set:
+        # the empty string is in every report
+        matched = set(self._literals.get(b'', []))
+        if self._automaton is None:
+            for literal, indexes in self._literals.items():
+                if literal in report_bytes:
+                    matched.update(indexes)
+            return matched
+
+        expected = sum(len(indexes) for indexes in self._literals.values())
+        # latin-1 decoding is a straight copy, unlike validating and decoding UTF-8
+        for _, indexes in self._automaton.iter(report_bytes.decode('latin-1')):
+            matched.update(indexes)
+            if len(matched) == expected:
+                break
+        return matched
+
+    def _bytes_pattern(self, index: int) -> re.Pattern | None:
+        '''
+        The bytes equivalent of an ASCII text pattern, for searching an ASCII report.
+        Valid JSON can't contain raw control characters, which are the only ASCII
+        characters str and bytes patterns treat differently (\\s matches \\x1c-\\x1f).
+        '''
+        if index not in self._bytes_patterns:
+            pattern = self._patterns[index]
+            converted = None
+            if pattern.pattern.isascii():
+                try:
+                    converted = re.compile(pattern.pattern.encode('ascii'), pattern.flags & ~re.UNICODE)
+                except re.error:
+                    # eg: \u escapes are only valid in text patterns
+                    pass
+            self._bytes_patterns[index] = converted
+        return self._bytes_patterns[index]
+
+    def _searched_pattern(self, index: int, searches_bytes: bool) -> re.Pattern:
+        pattern = self._patterns[index]
+        if searches_bytes and isinstance(pattern.pattern, str):
+            return self._bytes_pattern(index)
+        return pattern
+
+    def _plan_patterns(self, ascii_report: bool) -> List[tuple]:
+        '''
+        Group the patterns hyperscan isn't handling into (searches_bytes, [indexes])
+        groups which can each be searched as one alternation
+        '''
+        groups = {}
+        for index, pattern in self._patterns.items():
+            searches_bytes = isinstance(pattern.pattern, bytes)
+            if not searches_bytes and ascii_report and self._bytes_pattern(index) is not None:
+                pattern = self._bytes_pattern(index)
+                searches_bytes = True
+            # numbered groups would be renumbered by the alternation, and verbose
+            # comments would swallow the rest of it, so these are searched alone
+            if pattern.groups or pattern.flags & re.VERBOSE:
+                groups[(searches_bytes, pattern.flags, index)] = [index]
+            else:
+                groups.setdefault((searches_bytes, pattern.flags), []).append(index)
+
+        plan = []
+        for key, indexes in groups.items():
+            searches_bytes = key[0]
+            if len(indexes) > 1:
+                try:
+                    self._alternation(searches_bytes, tuple(indexes))
+                except re.error:
+                    # eg: inline flags that are only allowed at the start of a pattern
+                    plan.extend((searches_bytes, [i]) for i in indexes)
+                    continue
+            plan.append((searches_bytes, indexes))
+        return plan
+
+    def _alternation(self, searches_bytes: bool, indexes: tuple) -> re.Pattern:
+        alternation = self._alternations.get((searches_bytes, indexes))
+        if alternation is None:
+            patterns = [self._searched_pattern(i, searches_bytes) for i in indexes]
+            if searches_bytes:
+                source = b'|'.join(b'(?P<v%d>%s)' % (i, p.pattern) for i, p in zip(indexes, patterns))
+            else:
+                source = '|'.join(f'(?P<v{i}>{p.pattern})' for i, p in zip(indexes, patterns))
+            alternation = re.compile(source, patterns[0].flags)
+            self._alternations[(searches_bytes, indexes)] = alternation
+        return alternation
+
+    def _scan_patterns(self, report_bytes: bytes, get_report_string: Callable[[], str]) -> List[int]:
+        if not self._patterns:
+            return []
+        ascii_report = report_bytes.isascii()
+        plan = self._pattern_plans.get(ascii_report)
+        if plan is None:
+            plan = self._pattern_plans[ascii_report] = self._plan_patterns(ascii_report)
+
+        matched = []
+        for searches_bytes, indexes in plan:
+            haystack = report_bytes if searches_bytes else get_report_string()
+            if len(indexes) == 1:
+                if self._searched_pattern(indexes[0], searches_bytes).search(haystack) is not None:
+                    matched.append(indexes[0])
+            else:
+                matched.extend(self._scan_alternation(haystack, searches_bytes, indexes))
+        return matched
+
+    def _scan_alternation(self, haystack, searches_bytes: bool, indexes: List[int]) -> List[int]:
+        '''
+        Returns the indexes of the verifiers in an alternation group that match the report.
+        A match of one alternative can hide a match of another starting at the same place,
+        so each time a verifier matches it is dropped from the alternation and the search
+        resumes from that match. No remaining pattern can match before it.
+        '''
+        matched = []
+        pending = list(indexes)
+        pos = 0
+        while pending:
+            match = self._alternation(searches_bytes, tuple(pending)).search(haystack, pos)
+            if match is None:
+                break
+            index = int(match.lastgroup[1:])
+            matched.append(index)
+            pending.remove(index)
+            pos = match.start()
+        return matched
+
+
+_SCOPED_IGNORECASE = re.compile(rb'\(\?[a-zA-Z]*-?[a-zA-Z]*i[a-zA-Z]*:')
+
+
+def _hyperscan_expression(verifier):
+    '''Returns the (expression, flags) hyperscan needs to evaluate a verifier, or None'''
+    flags = hyperscan.HS_FLAG_SINGLEMATCH | hyperscan.HS_FLAG_ALLOWEMPTY
+
+    if isinstance(verifier, VerifyReportHasExactString):
+        # escape every byte so the literal can't be read as regex syntax
+        return ''.join(f'\\x{b:02x}' for b in verifier.pattern_bytes).encode('ascii'), flags
+
+    pattern = verifier.pattern
+    is_text = isinstance(pattern.pattern, str)
+    source = pattern.pattern.encode('utf-8') if is_text else pattern.pattern
+    # \Z, \N, \v (only \x0b in re, all vertical whitespace in hyperscan), {,n} and [: (POSIX classes
+    # like [[:alpha:]]) mean something different to hyperscan's PCRE syntax
+    if any(token in source for token in (b'\\Z', b'\\N', b'\\v', b'{,', b'[:')):
+        return None
+
+    supported = re.IGNORECASE | re.MULTILINE | re.DOTALL | re.UNICODE | re.ASCII
+    if pattern.flags & ~supported:
+        return None
+    # hyperscan's Unicode case folding differs from re's (eg: re's (?i)i matches İ and ı), so
+    # case-insensitive text patterns, including scoped (?i:...) groups, are left to re
+    if is_text and (pattern.flags & re.IGNORECASE or _SCOPED_IGNORECASE.search(source)):
+        return None
+    if is_text:
+        flags |= hyperscan.HS_FLAG_UTF8
+        if not pattern.flags & re.ASCII:
+            flags |= hyperscan.HS_FLAG_UCP
+    if pattern.flags & re.IGNORECASE:
+        flags |= hyperscan.HS_FLAG_CASELESS
+    if pattern.flags & re.MULTILINE:
+        flags |= hyperscan.HS_FLAG_MULTILINE
+    if pattern.flags & re.DOTALL:
+        flags |= hyperscan.HS_FLAG_DOTALL
+    return source, flags
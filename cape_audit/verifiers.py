@@ -1,9 +1,16 @@
 from typing import Dict, Any, List
+import mmap
+import os
 import re
-from pathlib import Path
+import stat
+from .report import ReportView
+
+_UNRESOLVED = object()
 
 
 class MissingResultVerifier:
+    needs_report_string = False
+
     def evaluate(self, report: Dict[str, Any], report_string: str, test_storage_directory: str) -> bool:
         raise Exception("No verifier was attached to this objective")
 
@@ -12,15 +19,17 @@ class VerifyReportSectionHasContent:
     """
     Assert that the CAPE report.json contains a specific section
     """
+    needs_report_string = False
+
     def __init__(
         self, 
         path: str
     ):
         self.path = path  # e.g., "behavior/processes/calls"
+        self._inner_verifier = VerifyReportSectionHasMatching(self.path, [])
         
     def evaluate(self, report: Dict[str, Any], report_string: str, test_storage_directory: str) -> bool:
-        innerVerifier = VerifyReportSectionHasMatching(self.path, [])
-        return innerVerifier.has_content(report)
+        return self._inner_verifier.has_content(report)
 
 
 class VerifyReportSectionHasMatching:
@@ -31,17 +40,24 @@ class VerifyReportSectionHasMatching:
     path -- the path in the json document eg: "behavior/processes/calls" searches for {"behaviour":{"processes":[{"calls":[...]}]}}
     match_criteria -- eg: [{ "api": "OutputDebugStringA"}, {"arguments/value": r"FLAG_1"}]
     values_are_regexes -- if true, matches the match_criteria as regular expressions. If false - exact string matches.
+    any_target -- if true, each criterion can be met by a different item at the path. If false - one item must meet them all.
     """
+    needs_report_string = False
+
     def __init__(
         self, 
         path: str, 
         match_criteria: List[Dict[str, Any]] | None,
-        values_are_regexes: bool = False
+        values_are_regexes: bool = False,
+        any_target: bool = False
     ):
         self.path = path  # e.g., "behavior/processes/calls"
         self.match_criteria = match_criteria
         self.is_regexes = values_are_regexes
+        self.any_target = any_target
         self.check_criteria_format()
+        self._path_keys = tuple(path.split('/'))
+        self._compiled_criteria = self._compile_criteria()
 
     def check_criteria_format(self):
         if self.match_criteria is None:
@@ -56,12 +72,20 @@ class VerifyReportSectionHasMatching:
             if len(criterion) != 1:
                 raise ValueError(f"Invalid criteria: {criterion}. Expected exactly one key-value pair.")
 
+    def _compile_criteria(self) -> List[tuple]:
+        """Split each criterion into (path keys, expected string, compiled regex or None) up front"""
+        compiled = []
+        for criterion in self.match_criteria or []:
+            expected_path, expected_value = next(iter(criterion.items()))
+            pattern = re.compile(expected_value) if self.is_regexes else None
+            compiled.append((tuple(expected_path.split('/')), str(expected_value), pattern))
+        return compiled
+
     def has_content(self, report) -> bool:
-        targets = self._resolve_path(report, self.path)
-        if targets:
-            return True
-        else:
-            return False
+        path_index = getattr(report, 'path_index', None)
+        if path_index is not None and self._path_keys in path_index:
+            return bool(path_index[self._path_keys])
+        return self._path_exists(report, self._path_keys)
 
     def evaluate(self, report: Dict[str, Any], report_string: str, test_storage_directory: str) -> bool:
         """
@@ -73,7 +97,7 @@ class VerifyReportSectionHasMatching:
         test_storage_directory -- the path of the storage directory, for custom test evaluation
         """
         # 1. Resolve the path to get the list of items (processes or calls)
-        targets = self._resolve_path(report, self.path)
+        targets = self._resolve_report_path(report, self._path_keys)
         
         if not isinstance(targets, list):
             # If the result is a single dict, wrap it in a list so we can iterate
@@ -81,72 +105,217 @@ class VerifyReportSectionHasMatching:
 
         if self.match_criteria is None:
             return True
-        
-        match_count_target = len(self.match_criteria) 
-        for target in targets:
-            match_count = 0
-            for criterion in self.match_criteria:
-                expected_path, expected_value = next(iter(criterion.items()))
 
+        path_index = getattr(report, 'path_index', None)
+        if path_index is not None and not self.is_regexes and self._compiled_criteria:
+            return self._evaluate_indexed(path_index, targets)
+
+        criteria = self._compiled_criteria
+        if not criteria:
+            return False
+
+        if self.any_target:
+            # Each criterion only has to be met once, so stop checking it after that
+            satisfied = [False] * len(criteria)
+            remaining = len(criteria)
+            for target in targets:
+                for i, (expected_keys, expected_value, pattern) in enumerate(criteria):
+                    if satisfied[i]:
+                        continue
+                    if self._verify_value(self._resolve_keys(target, expected_keys, 0), expected_value, pattern):
+                        satisfied[i] = True
+                        remaining -= 1
+                        if remaining == 0:
+                            return True
+            return False
+
+        for target in targets:
+            for expected_keys, expected_value, pattern in criteria:
                 # For each criteria, resolve the path RELATIVE to the target
-                found_vals = self._resolve_path(target, expected_path)
-                
-                # If resolve_path found the value (even inside a nested list)
-                if self._verify_value(found_vals, expected_value):
-                    match_count += 1
-                    if match_count >= match_count_target:
-                        return True
+                found_vals = self._resolve_keys(target, expected_keys, 0)
+
+                # If resolve_path found the value (even inside a nested list).
+                # The target can't match once a criterion fails, so move on to the next one
+                if not self._verify_value(found_vals, expected_value, pattern):
+                    break
+            else:
+                return True
         return False
 
-    def _resolve_path(self, data: Any, path: str) -> Any:
+    def _evaluate_indexed(self, path_index: Dict[tuple, Any], targets: list) -> bool:
+        """
+        Exact-match evaluation using per-criterion value indexes instead of comparing
+        every target against every criterion. Each index maps the string form of a value
+        to the positions of the targets that have it, so a criterion is a dict lookup
+        and all criteria matching in one target is a set intersection.
+        """
+        candidates = None
+        for expected_keys, expected_value, _ in self._compiled_criteria:
+            rows = self._value_index(path_index, targets, expected_keys).get(expected_value)
+            if not rows:
+                return False
+            if self.any_target:
+                continue
+            candidates = rows if candidates is None else candidates & rows
+            if not candidates:
+                return False
+        return True
+
+    def _value_index(self, path_index: Dict[tuple, Any], targets: list, keys: tuple) -> Dict[str, set]:
+        """
+        Maps str(value) -> {target positions} for the values at keys relative to each target.
+        Stored in the report's path_index so verifiers on the same path and field share it.
+        """
+        index_key = (self._path_keys, keys)
+        value_index = path_index.get(index_key)
+        if value_index is None:
+            value_index = {}
+            for row, target in enumerate(targets):
+                found = self._resolve_keys(target, keys, 0)
+                for value in (found if isinstance(found, list) else [found]):
+                    value = str(value)
+                    rows = value_index.get(value)
+                    if rows is None:
+                        value_index[value] = {row}
+                    else:
+                        rows.add(row)
+            path_index[index_key] = value_index
+        return value_index
+
+    def _resolve_report_path(self, report: Any, keys: tuple) -> Any:
+        """
+        _resolve_path from the root of the report, reusing the result if another
+        verifier has already resolved the same path in an IndexedReport/ReportView
+        """
+        path_index = getattr(report, 'path_index', None)
+        if path_index is None:
+            return self._resolve_keys(report, keys, 0)
+
+        result = path_index.get(keys, _UNRESOLVED)
+        if result is _UNRESOLVED:
+            result = path_index[keys] = self._resolve_keys(report, keys, 0)
+        return result
+
+    def _resolve_path(self, data: Any, path: str | tuple) -> Any:
         """
-        Recursively descends into data. 
+        Descends into data following the path (eg: "processes/calls", or already split into keys).
         If it hits a list, it flattens the results from all items in that list.
         """
-        keys = path.split('/')
+        keys = tuple(path.split('/')) if isinstance(path, str) else path
+        return self._resolve_keys(data, keys, 0)
+
+    def _resolve_keys(self, data: Any, keys: tuple, start: int) -> Any:
+        """_resolve_path for the path keys from index start onwards, without copying the keys"""
         current = data
 
-        for i, key in enumerate(keys):
+        for i in range(start, len(keys)):
             if isinstance(current, list):
                 # List of dicts, so we have to check the path of every item
-                remaining_path = "/".join(keys[i:])
-                results = []
-                for item in current:
-                    res = self._resolve_path(item, remaining_path)
-                    if isinstance(res, list):
-                        results.extend(res)
-                    elif res is not None:
-                        results.append(res)
-                return results
+                return self._resolve_list_path(current, keys, i)
             
-            if not isinstance(current, dict):
+            if not isinstance(current, (dict, ReportView)):
                 return None
-            current = current.get(key)
+            current = current.get(keys[i])
 
         return current
 
-    def _verify_value(self, found: Any, expected: Any) -> bool:
-        """Checks if expected value exists in found (handles single values or lists)"""
+    @staticmethod
+    def _resolve_list_path(items: list, keys: tuple, start: int) -> list:
+        """
+        Follows the path keys (from index start) through every item of a list, one key
+        at a time across the whole frontier rather than recursing per item. Nested lists
+        are flattened and items that don't have the path are dropped.
+        """
+        frontier = [items]
+        for i in range(start, len(keys)):
+            key = keys[i]
+            found = []
+            append = found.append
+            pending = frontier
+            while pending:
+                nested = []
+                for node in pending:
+                    if isinstance(node, dict):
+                        append(node.get(key))
+                    elif isinstance(node, list):
+                        nested.extend(node)
+                pending = nested
+            frontier = found
+            if not frontier:
+                return []
+
+        results = []
+        for value in frontier:
+            if isinstance(value, list):
+                results.extend(value)
+            elif value is not None:
+                results.append(value)
+        return results
+
+    def _path_exists(self, data: Any, keys: tuple) -> bool:
+        """
+        Equivalent to bool(self._resolve_path(data, keys)), but returns as soon as
+        the first matching leaf is found instead of collecting all of them
+        """
+        current = data
+
+        for i, key in enumerate(keys):
+            if isinstance(current, list):
+                return self._list_path_exists(current, keys, i)
+
+            if not isinstance(current, (dict, ReportView)):
+                return False
+            current = current.get(key)
+
+        return bool(current)
+
+    @staticmethod
+    def _list_path_exists(items: list, keys: tuple, start: int) -> bool:
+        last = len(keys) - 1
+        stack = [(items, start)]
+        while stack:
+            node, i = stack.pop()
+            if isinstance(node, dict):
+                value = node.get(keys[i])
+                if i < last:
+                    stack.append((value, i + 1))
+                elif value is not None and (value or not isinstance(value, list)):
+                    # _resolve_path flattens a list leaf into its results, so only a non-empty one counts
+                    return True
+            elif isinstance(node, list):
+                stack.extend((item, i) for item in reversed(node))
+        return False
+
+    def _verify_value(self, found: Any, expected: str, pattern: re.Pattern | None) -> bool:
+        """
+        Checks if expected value exists in found (handles single values or lists).
+        expected is already a string and pattern is precompiled by _compile_criteria.
+        """
 
         found_list = found if isinstance(found, list) else [found]
-        if self.is_regexes:
-            pattern = re.compile(expected)
-            return any(pattern.search(str(v)) for v in found_list)
+        if pattern is not None:
+            search = pattern.search
+            return any(search(str(v)) for v in found_list)
         
-        if isinstance(found, list):
-            return any(str(v) == str(expected) for v in found)
-        return str(found) == str(expected)
+        return any(str(v) == expected for v in found_list)
     
 
 class VerifyReportHasExactString:
     """
     evaluate returns true if the raw text of report.json contains a specific string
+    Keyword arguments
+    pattern -- the string to find, as text or UTF-8 bytes
     """
+    needs_report_string = True
+
     def __init__(
         self, 
-        pattern: str
+        pattern: str | bytes
     ):
         self.pattern = pattern
+        self.pattern_bytes = pattern.encode('utf-8') if isinstance(pattern, str) else pattern
+        # set while a ReportTextScanner has already searched the report for this verifier
+        self._prescan_result = None
         
     def evaluate(self, report: Dict[str, Any], report_string: str, test_storage_directory: str) -> bool:
         """
@@ -154,20 +323,33 @@ class VerifyReportHasExactString:
 
         Keyword arguments
         report -- report.json parsed as a dictionary
-        report_string -- report.json as a raw string for direct searching
+        report_string -- report.json as a raw string (or UTF-8 bytes) for direct searching
         test_storage_directory -- the path of the storage directory, for custom test evaluation
         """
+        if self._prescan_result is not None:
+            return self._prescan_result
+        if isinstance(report_string, bytes):
+            return self.pattern_bytes in report_string
+        if isinstance(self.pattern, bytes):
+            return self.pattern in report_string.encode('utf-8')
         return self.pattern in report_string
 
 class VerifyReportHasPattern:
     """
     evaluate returns true if the raw text of report.json matches the provided regex
+    Keyword arguments
+    pattern -- compiled regex, or a regex string which is compiled once here.
+               bytes patterns are matched against the UTF-8 encoded report.
     """
+    needs_report_string = True
+
     def __init__(
         self, 
-        pattern: re.Pattern
+        pattern: re.Pattern | str | bytes
     ):
-        self.pattern = pattern  # e.g., "behavior/processes/calls"
+        self.pattern = re.compile(pattern) if isinstance(pattern, (str, bytes)) else pattern
+        # set while a ReportTextScanner has already searched the report for this verifier
+        self._prescan_result = None
         
     def evaluate(self, report: Dict[str, Any], report_string: str, test_storage_directory: str) -> bool:
         """
@@ -175,9 +357,15 @@ class VerifyReportHasPattern:
 
         Keyword arguments
         report -- report.json parsed as a dictionary
-        report_string -- report.json as a raw string for direct searching
+        report_string -- report.json as a raw string (or UTF-8 bytes) for direct searching
         test_storage_directory -- the path of the storage directory, for custom test evaluation
         """
+        if self._prescan_result is not None:
+            return self._prescan_result
+        if isinstance(self.pattern.pattern, bytes) and isinstance(report_string, str):
+            report_string = report_string.encode('utf-8')
+        elif isinstance(self.pattern.pattern, str) and isinstance(report_string, bytes):
+            report_string = report_string.decode('utf-8')
         return self.pattern.search(report_string) is not None
 
 
@@ -186,36 +374,63 @@ class VerifyFileContainsPattern:
     evaluate returns true if the file matches the provided regex
     Keyword arguments
     storage_relative_path -- file in the storage directory eg: 'analysis.log', 'tlsdump/tlsdump.log'
-    pattern -- regex to match
+    pattern -- regex to match, compiled or as a string/bytes
     binary_mode -- True if the expected file and pattern is bytes instead of text
+
+    Files searched with a bytes pattern (or in binary_mode) are memory-mapped rather
+    than read into memory. Text patterns are matched against the decoded file.
     """
+    needs_report_string = False
+
     def __init__(
         self, 
         storage_relative_path: str,
-        pattern: re.Pattern,
+        pattern: re.Pattern | str | bytes,
         binary_mode: bool = False
     ):
-        self.pattern = pattern  # e.g., "behavior/processes/calls"
+        if isinstance(pattern, (str, bytes)):
+            pattern = re.compile(pattern)
+        self.pattern = pattern
         self.relative_path = storage_relative_path
         self.binary_mode = binary_mode
         
     def evaluate(self, report: Dict[str, Any], report_string: str, test_storage_directory: str) -> bool:
-        base_dir = Path(test_storage_directory).resolve()
-        file_path = (base_dir / self.relative_path).resolve()
-        
-        try:
-            file_path.relative_to(base_dir)
-        except ValueError:
+        file_path = os.path.realpath(os.path.join(test_storage_directory, self.relative_path))
+
+        # CapeDynamicTestBase passes an already resolved storage directory, so it is only
+        # resolved here if the file doesn't appear to be inside it as given
+        if not self._is_within(test_storage_directory, file_path) and \
+                not self._is_within(os.path.realpath(test_storage_directory), file_path):
             raise ValueError("Non-relative path supplied to VerifyFileContainsPattern: "+self.relative_path)
 
-        if not file_path.exists():
+        try:
+            st = os.stat(file_path)
+        except (FileNotFoundError, NotADirectoryError):
             return False
 
-        if not file_path.is_file():
+        if not stat.S_ISREG(st.st_mode):
             return False
 
-        mode = 'rb' if self.binary_mode else 'r'
-        with file_path.open(mode) as f:
-            data = f.read()
-        
-        return bool(self.pattern.search(data))
+        if not self.binary_mode and isinstance(self.pattern.pattern, str):
+            with open(file_path, 'r') as f:
+                data = f.read()
+            return bool(self.pattern.search(data))
+
+        with open(file_path, 'rb') as f:
+            if st.st_size == 0:
+                # empty files can't be mapped
+                return self.pattern.search(b"") is not None
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                return self.pattern.search(data) is not None
+
+    @staticmethod
+    def _is_within(base_dir: str, path: str) -> bool:
+        '''
+        Whether the resolved path is inside base_dir. A resolved path has no symlinks or
+        '..' components, so if it starts with base_dir then base_dir is resolved too.
+        '''
+        try:
+            return os.path.commonpath([base_dir, path]) == base_dir
+        except ValueError:
+            # eg: paths on different drives, or a relative base_dir
+            return False
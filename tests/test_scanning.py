@@ -0,0 +1,103 @@
+import json
+import random
+import re
+import unittest
+import warnings
+from unittest import mock
+
+from cape_audit import scanning
+from cape_audit.scanning import ReportTextScanner
+from cape_audit.verifiers import VerifyReportHasExactString, VerifyReportHasPattern
+
+'''Which optional matching engines each scan is run with'''
+ENGINES = {
+    "installed": {"hyperscan": scanning.hyperscan, "ahocorasick": scanning.ahocorasick},
+    "no hyperscan": {"hyperscan": None},
+    "no ahocorasick": {"ahocorasick": None},
+    "re only": {"hyperscan": None, "ahocorasick": None},
+}
+
+REPORTS = [
+    json.dumps({"behavior": {"processes": [{"calls": [{"api": "NtDelayExecution", "arguments": [{"value": "1337"}]}]}]}}),
+    json.dumps({"target": {"file": {"name": "Café été ÉTÉ.exe"}}, "note": "abc abcd ABC"}, ensure_ascii=False),
+    json.dumps({"signatures": ["x1", "[[:alpha:]]", "line\r\nend", "tab\there"]}),
+    json.dumps({"a": "b", "c": ["d"]}, indent=1),
+    json.dumps({"user": "İbrahim", "host": "ışık"}, ensure_ascii=False),
+    # bare text, so the case folding and vertical whitespace differences aren't hidden by other matches
+    "a\nb",
+    "ı",
+    "İ",
+    "",
+]
+
+EXACT_STRINGS = ["", "NtDelayExecution", "1337", "abc", "abcd", "bcd", "Café", "ÉTÉ", "missing", "\"api\"",
+                 b"abc", "é".encode('utf-8'), b"\xff"]
+
+PATTERNS = [
+    r"Nt\w+Execution", r"13(3)7", r"abc", r"abcd?", r"b(?:c|x)d", r"(?i)abc\b", r"caf.", r"été", r"ÉTÉ",
+    r"\d{,2}x", r"[[:alpha:]]", r"end\Z", r"\N{LATIN SMALL LETTER E WITH ACUTE}", r"(a)\1", r"^\{", r"\}$",
+    r"(?x) a b c  # comment", r"\s\S", r"[^\x00-\x7f]", r"nomatch", r"", rb"abc", rb"\xc3\xa9", rb"\w+\.exe",
+    re.compile(r"ÉTÉ", re.I), re.compile(r"caf[é]", re.I), re.compile(r"^end", re.M), re.compile(r"e.e", re.S),
+    re.compile(r"\w+", re.A), re.compile(r"ETE", re.I | re.A),
+    r"a\vb", r"[\v]", r"(?i)i", r"(?i)[a-z]", r"(?i)[^a-z]", r"x(?i:s)", rb"(?i)ABC",
+]
+
+
+def expected_result(verifier, text: str) -> bool:
+    '''What the verifier returns when it searches the report itself'''
+    if isinstance(verifier, VerifyReportHasExactString):
+        return verifier.pattern_bytes in text.encode('utf-8')
+    haystack = text.encode('utf-8') if isinstance(verifier.pattern.pattern, bytes) else text
+    return verifier.pattern.search(haystack) is not None
+
+
+class TestReportTextScanner(unittest.TestCase):
+    '''
+    The scanner batches verifiers with hyperscan, Aho-Corasick and combined regexes
+    and searches bytes where it can, which must give the same results as each
+    verifier searching the decoded report on its own
+    '''
+    def setUp(self):
+        # patterns like [[:alpha:]] trigger re's nested set warnings
+        warnings.simplefilter("ignore", FutureWarning)
+        self.addCleanup(warnings.resetwarnings)
+
+    def assert_matches_reference(self, verifiers, reports):
+        for engine, disabled in ENGINES.items():
+            with mock.patch.multiple(scanning, **disabled):
+                scanner = ReportTextScanner(verifiers)
+                for text in reports:
+                    scanner.scan(text.encode('utf-8'), lambda: text)
+                    for verifier in verifiers:
+                        with self.subTest(engine=engine, pattern=verifier.pattern, report=text[:40]):
+                            self.assertEqual(verifier.evaluate({}, "", ""), expected_result(verifier, text))
+                    scanner.clear()
+
+    def test_fixed_cases(self):
+        verifiers = [VerifyReportHasExactString(s) for s in EXACT_STRINGS]
+        verifiers += [VerifyReportHasPattern(p) for p in PATTERNS]
+        self.assert_matches_reference(verifiers, REPORTS)
+
+    def test_random_cases(self):
+        rng = random.Random(1234)
+        alphabet = "ab c\"{}:,é\n"
+        reports = [''.join(rng.choice(alphabet) for _ in range(rng.randint(0, 60))) for _ in range(20)]
+        reports += [r.replace("é", "e") for r in reports]
+        pieces = ["a", "b", "c", "é", ".", r"\s", "[ab]", "(?:a|bc)", "b*", '"', r"\{", "$"]
+        patterns = {''.join(rng.choice(pieces) for _ in range(rng.randint(1, 4))) for _ in range(40)}
+        literals = {''.join(rng.choice("abcé ") for _ in range(rng.randint(1, 3))) for _ in range(20)}
+        verifiers = [VerifyReportHasPattern(p) for p in sorted(patterns)]
+        verifiers += [VerifyReportHasExactString(s) for s in sorted(literals)]
+        self.assert_matches_reference(verifiers, reports)
+
+    def test_clear_restores_direct_search(self):
+        verifier = VerifyReportHasExactString("needle")
+        scanner = ReportTextScanner([verifier])
+        scanner.scan(b"needle", lambda: "needle")
+        self.assertTrue(verifier.evaluate({}, "", ""))
+        scanner.clear()
+        self.assertFalse(verifier.evaluate({}, "", ""))
+
+
+if __name__ == "__main__":
+    unittest.main()